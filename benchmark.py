@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Бенчмарки RTE Zones: загрузка данных, проверка точек и сохранение.
+
+Замеры выполняются на polygons.xlsx и на синтетически увеличенных наборах
+геозон (копии исходных полигонов со сдвигом и новыми ID), результаты
+печатаются таблицей и сохраняются в JSON для отслеживания регрессий.
+Увеличенные наборы загружаются из CSV; загрузка и сохранение Excel
+замеряются на исходном .xlsx (и на увеличенных наборах с --xlsx).
+
+    python benchmark.py --scales 1 10 --output bench.json
+    python benchmark.py --compare bench.json --threshold 1.2
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, List, Optional
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from rte_zones import RTEZoneChecker
+
+
+def scale_polygons(df: pd.DataFrame, scale: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Увеличивает набор геозон в scale раз.
+
+    Каждая копия сдвинута на небольшое случайное расстояние (до ~5 км),
+    поэтому плотность перекрывающихся геозон растет вместе с масштабом -
+    это худший случай для проверки точек.
+    """
+    if scale == 1:
+        return df
+
+    rng = np.random.default_rng(seed)
+    geometries = shapely.from_wkt(df['WKT'].to_numpy(dtype=object), on_invalid='ignore')
+    copies = [df]
+    for i in range(1, scale):
+        copy = df.copy()
+        dx, dy = rng.uniform(-0.08, 0.08), rng.uniform(-0.05, 0.05)
+        shifted = shapely.transform(geometries, lambda coords: coords + (dx, dy))
+        copy['WKT'] = np.where(pd.isna(shifted), copy['WKT'], shapely.to_wkt(shifted, rounding_precision=7))
+        for column in ('ID внутренний', 'ID реста'):
+            if column in copy.columns:
+                copy[column] = copy[column].astype(str) + f'-{i}'
+        copies.append(copy)
+    return pd.concat(copies, ignore_index=True)
+
+
+def sample_points(checker: RTEZoneChecker, count: int, seed: int = 0) -> np.ndarray:
+    """Точки около центров случайных геозон: часть попадает в геозоны, часть нет."""
+    rng = np.random.default_rng(seed)
+    geometries = checker.gdf.geometry.values
+    centers = shapely.get_coordinates(shapely.centroid(geometries[rng.integers(0, len(geometries), count)]))
+    lats = centers[:, 1] + rng.normal(0, 0.03, count)
+    lons = centers[:, 0] + rng.normal(0, 0.05, count)
+    return np.column_stack([lats, lons])
+
+
+def measure(func: Callable, rounds: int, quiet: bool = True) -> List[float]:
+    """Время выполнения func в секундах для каждого из rounds запусков."""
+    timings = []
+    for _ in range(rounds):
+        stream = io.StringIO() if quiet else sys.stdout
+        with contextlib.redirect_stdout(stream):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(name: str, scale: int, zones: int, timings: List[float], calls: int = 1) -> dict:
+    """Статистика замера; для точечных операций - время одного вызова в микросекундах."""
+    if calls > 1:
+        values = [t / calls * 1e6 for t in timings]
+        unit = 'us/call'
+    else:
+        values = [t * 1e3 for t in timings]
+        unit = 'ms'
+    return {
+        'name': name,
+        'scale': scale,
+        'zones': zones,
+        'unit': unit,
+        'calls': calls,
+        'rounds': len(values),
+        'min': min(values),
+        'median': statistics.median(values),
+        'mean': statistics.fmean(values),
+    }
+
+
+def run_scale(source: pd.DataFrame, scale: int, args, workdir: str) -> List[dict]:
+    """Все замеры для одного масштаба набора геозон."""
+    polygons_file = os.path.join(workdir, f'polygons_x{scale}.csv')
+    snapshot_file = os.path.join(workdir, f'polygons_x{scale}.npz')
+    scaled = scale_polygons(source, scale, args.seed)
+    scaled.to_csv(polygons_file, index=False)
+
+    xlsx_file = None
+    if scale == 1 and args.polygons.endswith('.xlsx'):
+        xlsx_file = args.polygons
+    elif args.xlsx:
+        xlsx_file = os.path.join(workdir, f'polygons_x{scale}.xlsx')
+        scaled.to_excel(xlsx_file, index=False)
+
+    results = []
+    checker = None
+
+    def load():
+        nonlocal checker
+        checker = RTEZoneChecker(polygons_file)
+
+    results.append(summarize('load_data', scale, 0, measure(load, args.load_rounds)))
+    zones = len(checker.gdf)
+    results[-1]['zones'] = zones
+
+    if xlsx_file:
+        results.append(summarize('load_data_xlsx', scale, zones, measure(
+            lambda: RTEZoneChecker(xlsx_file), args.load_rounds)))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        RTEZoneChecker(polygons_file, snapshot_file=snapshot_file)
+    results.append(summarize('load_data_snapshot', scale, zones, measure(
+        lambda: RTEZoneChecker(polygons_file, snapshot_file=snapshot_file), args.load_rounds)))
+
+    points = sample_points(checker, args.points, args.seed)
+    lats, lons = points[:, 0], points[:, 1]
+    pairs = list(zip(lats.tolist(), lons.tolist()))
+
+    def point_loop(method):
+        return lambda: [method(lat, lon) for lat, lon in pairs]
+
+    for name, method in [
+        ('point_in_zones', checker.point_in_zones),
+        ('is_point_in_any_zone', checker.is_point_in_any_zone),
+        ('get_restaurants_for_point', checker.get_restaurants_for_point),
+    ]:
+        results.append(summarize(name, scale, zones, measure(point_loop(method), args.rounds), len(pairs)))
+
+    results.append(summarize('point_in_zones_many', scale, zones, measure(
+        lambda: checker.point_in_zones_many(lats, lons), args.rounds), len(pairs)))
+
+    save_file = os.path.join(workdir, f'saved_x{scale}.csv')
+    results.append(summarize('save_data', scale, zones, measure(
+        lambda: checker.save_data(save_file), args.load_rounds)))
+
+    if xlsx_file:
+        save_xlsx = os.path.join(workdir, f'saved_x{scale}.xlsx')
+        results.append(summarize('save_data_xlsx', scale, zones, measure(
+            lambda: checker.save_data(save_xlsx), args.load_rounds)))
+
+    return results
+
+
+def environment() -> dict:
+    """Версии и платформа, чтобы результаты разных запусков можно было сопоставить."""
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'shapely': shapely.__version__,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def compare(results: List[dict], baseline_file: str, threshold: float) -> bool:
+    """
+    Сравнивает медианы с сохраненным запуском.
+
+    Returns:
+        True, если ни один замер не стал медленнее более чем в threshold раз
+    """
+    with open(baseline_file, encoding='utf-8') as f:
+        baseline = {(r['name'], r['scale']): r for r in json.load(f)['results']}
+
+    print(f"\nСравнение с {baseline_file} (порог {threshold}x):")
+    ok = True
+    for result in results:
+        old = baseline.get((result['name'], result['scale']))
+        if old is None or old['unit'] != result['unit']:
+            continue
+        ratio = result['median'] / old['median'] if old['median'] else float('inf')
+        regressed = ratio > threshold
+        ok &= not regressed
+        mark = ' <- регрессия' if regressed else ''
+        print(f"  {result['name']:<28} x{result['scale']:<4} {old['median']:>10.2f} -> "
+              f"{result['median']:>10.2f} {result['unit']:<8} ({ratio:.2f}x){mark}")
+    return ok
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарки RTE Zones")
+    parser.add_argument('--polygons', default='polygons.xlsx', help="исходный файл с полигонами")
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10],
+                        help="во сколько раз увеличивать набор геозон")
+    parser.add_argument('--points', type=int, default=2000, help="число точек в замере проверок")
+    parser.add_argument('--rounds', type=int, default=5, help="повторов для проверок точек")
+    parser.add_argument('--load-rounds', type=int, default=3, help="повторов для загрузки и сохранения")
+    parser.add_argument('--xlsx', action='store_true',
+                        help="замерять загрузку и сохранение Excel и на увеличенных наборах")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help="файл для результатов в JSON")
+    parser.add_argument('--compare', default=None, help="JSON предыдущего запуска для сравнения")
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help="допустимое замедление медианы относительно --compare")
+    args = parser.parse_args(argv)
+
+    if args.polygons.endswith('.xlsx'):
+        source = pd.read_excel(args.polygons)
+    else:
+        source = pd.read_csv(args.polygons)
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for scale in args.scales:
+            print(f"Масштаб x{scale}...")
+            results.extend(run_scale(source, scale, args, workdir))
+
+    print(f"\n{'замер':<28} {'масштаб':<8} {'геозон':>8} {'медиана':>12} {'минимум':>12}")
+    for r in results:
+        print(f"{r['name']:<28} x{r['scale']:<7} {r['zones']:>8} {r['median']:>12.2f} "
+              f"{r['min']:>12.2f} {r['unit']}")
+
+    report = {'environment': environment(), 'settings': vars(args), 'results': results}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультаты сохранены в {args.output}")
+
+    if args.compare and not compare(results, args.compare, args.threshold):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
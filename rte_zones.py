@@ -4,173 +4,1671 @@ RTE Zones - Система проверки геозон доставки рес
 Позволяет проверить попадание геоточки в зоны доставки и добавить информацию о городах.
 """
 
+import argparse
+import asyncio
+import gc
+import io
+import math
+import numpy as np
 import pandas as pd
 import geopandas as gpd
-from shapely.wkt import loads
+import shapely
+from shapely import STRtree
 from shapely.geometry import Point
 import requests
+import os
+import signal
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Tuple, Optional, List
+from urllib.parse import parse_qs, urlsplit
 import json
 
 
+SNAPSHOT_VERSION = 2
+
+# Геозона определяется парой колонок: 'ID внутренний' общий для всех зон
+# одной точки ресторана, 'name' различает зоны (1 зона, 2 зона, ...)
+ZONE_KEY_COLUMNS = ['ID внутренний', 'name']
+
+# Колонки, которых достаточно для point_in_zones по идентификаторам
+# и get_restaurants_for_point (значение key_columns для RTEZoneChecker)
+LOOKUP_COLUMNS = ['name', 'ID внутренний', 'ID реста', 'Партнер']
+
+# Средний радиус Земли для перевода градусов в метры в локальной проекции
+EARTH_RADIUS_M = 6371008.8
+
+
+def _json_default(value):
+    """Преобразует значения, не поддерживаемые json (снимок, ответы HTTP-сервиса)."""
+    if isinstance(value, np.generic):
+        return value.item()
+    if pd.isna(value):
+        return None
+    return str(value)
+
+
+def _finite_json(value):
+    """Заменяет NaN и бесконечности (пустые ячейки CSV) на None, чтобы JSON был корректным."""
+    if isinstance(value, (float, np.floating)):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: _finite_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_finite_json(item) for item in value]
+    return value
+
+
+def _encode_column(series: pd.Series) -> np.ndarray:
+    """Кодирует колонку в JSON (UTF-8) для хранения в снимке."""
+    payload = json.dumps(series.tolist(), ensure_ascii=False, default=_json_default)
+    return np.frombuffer(payload.encode('utf-8'), dtype=np.uint8)
+
+
+def _decode_column(raw: np.ndarray, dtype: str) -> pd.Series:
+    """Восстанавливает колонку из снимка, по возможности с исходным типом."""
+    series = pd.Series(json.loads(raw.tobytes().decode('utf-8')), dtype=object)
+    series = series.infer_objects()
+    if str(series.dtype) != dtype:
+        try:
+            series = series.astype(dtype)
+        except (TypeError, ValueError):
+            pass
+    return series
+
+
+class _PinnedFile(io.RawIOBase):
+    """
+    Файл, открытый при загрузке и читаемый через os.pread.
+
+    Содержимое остается доступным, даже если файл по пути подменен
+    (os.replace) или удален. Позиция чтения хранится в объекте, а не в
+    дескрипторе, поэтому процессы после fork читают его независимо.
+    """
+
+    def __init__(self, fd: int):
+        super().__init__()
+        self._fd = fd
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        chunk = os.pread(self._fd, len(buffer), self._pos)
+        buffer[:len(chunk)] = chunk
+        self._pos += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += os.fstat(self._fd).st_size
+        self._pos = offset
+        return offset
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self):
+        if not self.closed:
+            os.close(self._fd)
+        super().close()
+
+
+def _meters_per_degree(lat: float) -> Tuple[float, float]:
+    """Метров в градусе долготы и широты около широты lat."""
+    per_degree = EARTH_RADIUS_M * math.pi / 180
+    return per_degree * math.cos(math.radians(lat)), per_degree
+
+
+class _PolygonIndex:
+    """
+    Пространственный индекс полигонов: STRtree поверх подготовленных геометрий.
+
+    Используется и для геозон доставки, и для границ городов. Геометрии
+    подготавливаются (shapely.prepare) один раз при построении, поэтому
+    повторные проверки contains не пересчитывают внутренние структуры полигонов.
+
+    Упрощенные внутренние/внешние приближения полигонов здесь не используются:
+    подготовленная геометрия ищет точку по индексу ребер, и стоимость contains
+    почти не зависит от числа вершин. На геозонах из ~800 вершин проверка
+    с приближениями оказалась не быстрее, а для одиночных точек - в 2 раза
+    медленнее из-за дополнительных вызовов.
+    """
+
+    def __init__(self, geometries):
+        self.geometries = np.asarray(geometries, dtype=object)
+        shapely.prepare(self.geometries)
+        self.tree = STRtree(self.geometries)
+
+    def query_point(self, lat: float, lon: float) -> np.ndarray:
+        """
+        Возвращает позиции полигонов, содержащих точку, по возрастанию.
+
+        Сначала индекс отбирает кандидатов по bounding box, затем
+        для них выполняется точная проверка contains.
+        """
+        point = Point(lon, lat)  # Shapely использует (lon, lat)
+        candidates = self.tree.query(point)
+        if len(candidates) == 0:
+            return candidates
+        mask = shapely.contains(self.geometries[candidates], point)
+        return np.sort(candidates[mask])
+
+    def contains_any(self, lat: float, lon: float) -> bool:
+        """
+        Проверяет, содержит ли точку хотя бы один полигон.
+
+        Кандидаты из индекса проверяются по одному до первого совпадения,
+        без построения промежуточных массивов и словарей.
+        """
+        point = Point(lon, lat)  # Shapely использует (lon, lat)
+        geometries = self.geometries
+        for position in self.tree.query(point):
+            if geometries[position].contains(point):
+                return True
+        return False
+
+    def query_points(self, lats: np.ndarray, lons: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Векторизованная проверка множества точек.
+
+        Returns:
+            Кортеж (point_idx, positions): точка point_idx лежит в полигоне
+            positions. Пары отсортированы по точкам, затем по полигонам.
+        """
+        points = shapely.points(lons, lats)
+        point_idx, positions = self.tree.query(points)
+        mask = shapely.contains_xy(self.geometries[positions], lons[point_idx], lats[point_idx])
+        point_idx, positions = point_idx[mask], positions[mask]
+
+        order = np.lexsort((positions, point_idx))
+        return point_idx[order], positions[order]
+
+    def candidates_within(self, lat: float, lon: float, meters: float) -> np.ndarray:
+        """Позиции полигонов, чей bounding box пересекает квадрат со стороной 2 * meters вокруг точки."""
+        per_lon, per_lat = _meters_per_degree(lat)
+        dlon, dlat = meters / max(per_lon, 1e-9), meters / per_lat
+        return self.tree.query(shapely.box(lon - dlon, lat - dlat, lon + dlon, lat + dlat))
+
+    def distances_m(self, lat: float, lon: float, positions: np.ndarray, boundary: bool = False) -> np.ndarray:
+        """
+        Расстояния в метрах от точки до полигонов positions.
+
+        Полигоны переводятся в локальную равнопромежуточную проекцию с центром
+        в точке (погрешность мала на расстояниях до десятков километров).
+        Для точки внутри полигона расстояние равно 0, если boundary=False,
+        и расстоянию до его границы, если boundary=True.
+        """
+        per_lon, per_lat = _meters_per_degree(lat)
+        projected = shapely.transform(
+            self.geometries[positions], lambda coords: (coords - (lon, lat)) * (per_lon, per_lat)
+        )
+        if boundary:
+            projected = shapely.boundary(projected)
+        return shapely.distance(projected, Point(0, 0))
+
+
+class _CoverageGrid:
+    """
+    Предвычисленное покрытие регулярной сеткой по долготе/широте.
+
+    Каждая ячейка размером cell_size градусов классифицируется как целиком
+    внутри какой-либо геозоны, целиком вне всех геозон или граничная.
+    Для первых двух ответ на "попадает ли точка в любую геозону" получается
+    одним поиском в словаре; точная проверка contains нужна только в
+    граничных ячейках. Хранятся только ячейки внутри bounding box геозон,
+    все остальные считаются внешними.
+    """
+
+    def __init__(self, index: _PolygonIndex, cell_size: float, max_cells: int = 5_000_000):
+        if cell_size <= 0:
+            raise ValueError("Размер ячейки должен быть положительным")
+        self.cell_size = cell_size
+        self.max_cells = max_cells
+        self.cells = {}
+        self._reclassify(index, shapely.bounds(index.geometries))
+
+    def updated(self, index: _PolygonIndex, changed_bounds: np.ndarray) -> '_CoverageGrid':
+        """
+        Новая сетка для index после изменения части геозон.
+
+        Состояние ячейки зависит только от пересекающих ее геозон, поэтому
+        пересчитываются лишь ячейки внутри bounding box измененных геозон
+        (старых и новых геометрий), остальные ячейки переиспользуются.
+        """
+        grid = _CoverageGrid.__new__(_CoverageGrid)
+        grid.cell_size = self.cell_size
+        grid.max_cells = self.max_cells
+        grid.cells = dict(self.cells)
+        # Запас в одну ячейку: геозона может касаться соседней ячейки по границе,
+        # которую floor относит к ней из-за округления
+        pad = self.cell_size
+        grid._reclassify(index, changed_bounds + np.array([-pad, -pad, pad, pad]))
+        return grid
+
+    def _reclassify(self, index: _PolygonIndex, bounds: np.ndarray):
+        """Заново классифицирует все ячейки, пересекающие прямоугольники bounds."""
+        cell_size = self.cell_size
+        bounds = bounds[~np.isnan(bounds).any(axis=1)]
+        x0 = np.floor(bounds[:, 0] / cell_size).astype(np.int64)
+        y0 = np.floor(bounds[:, 1] / cell_size).astype(np.int64)
+        nx = np.floor(bounds[:, 2] / cell_size).astype(np.int64) - x0 + 1
+        ny = np.floor(bounds[:, 3] / cell_size).astype(np.int64) - y0 + 1
+        counts = nx * ny
+        if counts.sum() > self.max_cells:
+            raise ValueError(f"Сетка с ячейкой {cell_size} слишком велика: "
+                             f"{int(counts.sum())} ячеек (максимум {self.max_cells})")
+
+        # Все ячейки, пересекающие хотя бы один из прямоугольников
+        owner = np.repeat(np.arange(len(counts)), counts)
+        offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cells = np.unique(np.column_stack([x0[owner] + offset % nx[owner],
+                                           y0[owner] + offset // nx[owner]]), axis=0)
+        cx, cy = cells[:, 0], cells[:, 1]
+        boxes = shapely.box(cx * cell_size, cy * cell_size, (cx + 1) * cell_size, (cy + 1) * cell_size)
+
+        touched = np.zeros(len(cells), dtype=bool)
+        touched[index.tree.query(boxes, predicate='intersects')[0]] = True
+
+        inside = np.zeros(len(cells), dtype=bool)
+        box_idx, positions = index.tree.query(boxes, predicate='within')
+        # contains_properly исключает ячейки, лежащие на границе полигона
+        mask = shapely.contains_properly(index.geometries[positions], boxes[box_idx])
+        inside[box_idx[mask]] = True
+
+        keys = list(zip(cx.tolist(), cy.tolist()))
+        for key, is_touched, is_inside in zip(keys, touched.tolist(), inside.tolist()):
+            if is_touched:
+                self.cells[key] = is_inside
+            else:
+                self.cells.pop(key, None)
+        self.inside_cells = sum(self.cells.values())
+        self.boundary_cells = len(self.cells) - self.inside_cells
+
+    def classify(self, lat: float, lon: float) -> Optional[bool]:
+        """
+        Returns:
+            True - ячейка целиком внутри геозоны, False - вне всех геозон,
+            None - граничная ячейка, нужна точная проверка
+        """
+        if not (math.isfinite(lat) and math.isfinite(lon)):
+            # NaN и бесконечности решает точная проверка, как без сетки
+            return None
+        size = self.cell_size
+        state = self.cells.get((math.floor(lon / size), math.floor(lat / size)))
+        if state is None:
+            return False
+        return True if state else None
+
+
+class _ZoneData:
+    """
+    Согласованный снимок загруженных геозон: таблицы, пространственный индекс
+    и предвычисленные массивы.
+
+    Перезагрузка строит новый экземпляр целиком и подменяет ссылку в
+    RTEZoneChecker одним присваиванием, поэтому вызов, уже получивший
+    снимок, дорабатывает на нем до конца.
+
+    Часть колонок может быть отложена (defer_columns): они читаются из
+    снимка или временного файла, открытых при загрузке, при первом
+    обращении (load_columns).
+    """
+
+    def __init__(self, df: pd.DataFrame, gdf: gpd.GeoDataFrame, load_errors: List[dict],
+                 source_stamp: Optional[Tuple[int, int]] = None):
+        self.df = df
+        self.gdf = gdf
+        self.load_errors = load_errors
+        self.source_stamp = source_stamp
+        self.index = _PolygonIndex(gdf.geometry.values)
+        self.columns = {}
+        self.coverage = None
+        self.compact = False
+        self.lazy_columns = []
+        self._lazy_loader = None
+        self._lazy_lock = threading.Lock()
+        self._restaurant_index = None
+
+    def defer_columns(self, columns: List[str], loader, column_order: Optional[List[str]] = None):
+        """
+        Убирает колонки из таблиц до первого обращения к ним.
+
+        Args:
+            columns: отложенные колонки
+            loader: функция loader(columns) -> DataFrame с этими колонками для
+                всех строк df (индекс - позиции строк в файле)
+            column_order: порядок колонок исходного файла; по умолчанию порядок df
+        """
+        self._column_order = list(column_order if column_order is not None else self.df.columns)
+        self.df = self.df.drop(columns=columns, errors='ignore')
+        self.gdf = self.gdf.drop(columns=columns, errors='ignore')
+        self.lazy_columns = [col for col in self._column_order if col in columns]
+        self._lazy_loader = loader
+
+    def _ordered(self, frame: pd.DataFrame) -> pd.DataFrame:
+        """Колонки исходного файла в исходном порядке, затем остальные (geometry, city)."""
+        order = [col for col in self._column_order if col in frame.columns]
+        return frame[order + [col for col in frame.columns if col not in order]]
+
+    def has_column(self, column: str) -> bool:
+        """Есть ли колонка в данных, в том числе среди отложенных."""
+        return column in self.gdf.columns or column in self.lazy_columns
+
+    def load_columns(self, columns: Optional[List[str]] = None):
+        """
+        Материализует отложенные колонки (все, если columns не задан).
+
+        Таблицы с новыми колонками собираются заново и подменяют текущие,
+        поэтому уже полученные вызывающим кодом df/gdf не меняются.
+        """
+        if not self.lazy_columns:
+            return
+        with self._lazy_lock:
+            requested = self.lazy_columns if columns is None else columns
+            missing = [col for col in self.lazy_columns if col in requested]
+            if not missing:
+                return
+
+            loaded = self._lazy_loader(missing)
+            df = self._ordered(pd.concat([self.df, loaded.loc[self.df.index]], axis=1))
+            gdf = self._ordered(self.gdf.join(loaded.loc[self.gdf.index]))
+
+            self.df = df
+            self.gdf = gdf
+            self.lazy_columns = [col for col in self.lazy_columns if col not in missing]
+
+    def restaurant_index(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Целочисленные коды ресторанов ('ID реста') для геозон, чтобы
+        get_restaurants_for_point группировал найденные геозоны по готовым
+        кодам, а не по значениям колонок. Строится при первом обращении.
+
+        'ID реста' не уникален между партнерами, поэтому партнер берется
+        по геозоне (как и раньше - по первой найденной геозоне ресторана).
+
+        Returns:
+            Кортеж (коды по геозонам, значения 'ID реста' по кодам, партнеры по геозонам)
+        """
+        if self._restaurant_index is None:
+            self._restaurant_index = self._build_restaurant_index()
+        return self._restaurant_index
+
+    def _build_restaurant_index(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        if self.has_column('ID реста'):
+            codes, restaurant_ids = pd.factorize(self.column_values('ID реста'), use_na_sentinel=False)
+        else:
+            codes = np.zeros(len(self.gdf), dtype=np.intp)
+            restaurant_ids = np.full(min(len(self.gdf), 1), 'unknown', dtype=object)
+
+        partners = self.optional_column_values('Партнер', 'Неизвестно')
+        return codes, np.asarray(restaurant_ids, dtype=object), partners
+
+    def make_compact(self):
+        """
+        Уменьшает память таблиц снимка до его публикации.
+
+        WKT разобранных геозон удаляется (геометрия уже хранится в gdf),
+        исходный текст остается только у строк с ошибками разбора.
+        Строковые колонки с повторяющимися значениями переводятся в category.
+        """
+        df = self.df.copy()
+        gdf = self.gdf.drop(columns='WKT', errors='ignore')
+        if 'WKT' in df.columns:
+            df['WKT'] = df['WKT'].where(~df.index.isin(gdf.index))
+
+        for column in df.columns:
+            if column == 'WKT' or isinstance(df[column].dtype, pd.CategoricalDtype):
+                continue
+            if df[column].dtype.kind in 'OUT' or pd.api.types.is_string_dtype(df[column]):
+                if df[column].nunique(dropna=False) <= len(df) // 2:
+                    df[column] = df[column].astype('category')
+                    if column in gdf.columns:
+                        gdf[column] = gdf[column].astype(df[column].dtype)
+
+        self.df, self.gdf = df, gdf
+        self.compact = True
+        self.columns = {}
+        self._restaurant_index = None
+
+    def column_values(self, column: str) -> np.ndarray:
+        """
+        Возвращает колонку gdf как массив numpy (кэшируется).
+
+        Кэш сбрасывается при изменении колонок самим классом (add_city_column).
+        """
+        values = self.columns.get(column)
+        if values is None:
+            if column in self.lazy_columns:
+                self.load_columns([column])
+            values = self.gdf[column].to_numpy(dtype=object)
+            self.columns[column] = values
+        return values
+
+    def optional_column_values(self, column: str, default) -> np.ndarray:
+        """Как column_values, но для отсутствующей колонки возвращает массив значений default."""
+        if self.has_column(column):
+            return self.column_values(column)
+        return np.full(len(self.gdf), default, dtype=object)
+
+
+class ZoneMatches:
+    """
+    Легковесный результат поиска геозон для точки.
+
+    Хранит только позиции найденных геозон. Индексы геозон, атрибуты и
+    геометрии извлекаются из колонок по запросу, поэтому вызывающий код
+    платит только за те данные, которые читает.
+    """
+
+    __slots__ = ('_data', 'positions')
+
+    def __init__(self, data: _ZoneData, positions: np.ndarray):
+        self._data = data
+        self.positions = positions
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def __bool__(self) -> bool:
+        return len(self.positions) > 0
+
+    def __getitem__(self, column: str) -> np.ndarray:
+        """Значения колонки column для найденных геозон."""
+        return self._data.column_values(column)[self.positions]
+
+    @property
+    def index(self) -> np.ndarray:
+        """Индексы найденных геозон (значение 'index' из point_in_zones)."""
+        return self._data.gdf.index.values[self.positions]
+
+    @property
+    def geometries(self) -> np.ndarray:
+        """Геометрии найденных геозон."""
+        return self._data.index.geometries[self.positions]
+
+    def to_dicts(self, include_geometry: bool = True) -> List[dict]:
+        """
+        Материализует результат в формате point_in_zones.
+
+        Args:
+            include_geometry: включать геометрию и исходную колонку 'WKT'
+        """
+        # В компактном режиме WKT не попадает в результаты, даже если его можно дочитать
+        skip = ('geometry',) if include_geometry and not self._data.compact else ('geometry', 'WKT')
+        self._data.load_columns([col for col in self._data.lazy_columns if col not in skip])
+        columns = [col for col in self._data.gdf.columns if col not in skip]
+        values = [self[col] for col in columns]
+        results = []
+        for idx, geometry, row in zip(self.index.tolist(), self.geometries, zip(*values)):
+            result = {'index': idx, 'geometry': geometry} if include_geometry else {'index': idx}
+            result.update(zip(columns, row))
+            results.append(result)
+        return results
+
+
+class TokenBucket:
+    """
+    Потокобезопасный ограничитель частоты запросов (token bucket).
+
+    Токены пополняются со скоростью rate в секунду, но не более capacity.
+    Каждый вызов acquire() забирает один токен, при необходимости ожидая его.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        if rate <= 0:
+            raise ValueError("Частота запросов должна быть положительной")
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Блокирует поток до получения токена."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = (1.0 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class GeocodeCache:
+    """
+    Постоянный кэш обратного геокодирования в SQLite.
+
+    Ключ - координаты, округленные до precision знаков после запятой
+    (4 знака - около 10 м), поэтому близкие центроиды и повторные запуски
+    не обращаются к геокодеру повторно. Записи старше ttl секунд
+    считаются устаревшими.
+    """
+
+    def __init__(self, path: str, precision: int = 4, ttl: Optional[float] = None):
+        self.path = path
+        self.precision = precision
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS geocode ("
+            "precision INTEGER, lat INTEGER, lon INTEGER, city TEXT, created REAL, "
+            "PRIMARY KEY (precision, lat, lon))"
+        )
+        self._conn.commit()
+
+    def _key(self, lat: float, lon: float) -> Optional[Tuple[int, int, int]]:
+        """Ключ записи или None для нечисловых координат (например, центроид пустой геометрии)."""
+        scale = 10 ** self.precision
+        lat, lon = lat * scale, lon * scale
+        if not (math.isfinite(lat) and math.isfinite(lon)):
+            return None
+        return self.precision, int(round(lat)), int(round(lon))
+
+    def get(self, lat: float, lon: float) -> Tuple[bool, Optional[str]]:
+        """
+        Ищет город в кэше.
+
+        Returns:
+            Кортеж (найдено, город). Город может быть None, если геокодер
+            ранее вернул пустой адрес.
+        """
+        key = self._key(lat, lon)
+        if key is None:
+            return False, None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT city, created FROM geocode WHERE precision = ? AND lat = ? AND lon = ?",
+                key,
+            ).fetchone()
+        if row is None or (self.ttl is not None and time.time() - row[1] > self.ttl):
+            return False, None
+        return True, row[0]
+
+    def set(self, lat: float, lon: float, city: Optional[str]):
+        """Сохраняет результат геокодирования."""
+        key = self._key(lat, lon)
+        if key is None:
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?, ?)",
+                (*key, city, time.time()),
+            )
+            self._conn.commit()
+
+    def close(self):
+        """Закрывает соединение с базой."""
+        with self._lock:
+            self._conn.close()
+
+
+class ResultCache:
+    """
+    Ограниченный LRU-кэш результатов проверки точек в памяти.
+
+    Ключ - вид запроса и координаты, округленные до precision знаков после
+    запятой (5 знаков - около 1 м), поэтому повторные запросы из одних и тех
+    же адресов не обращаются к индексу. Результат вычисляется для первой
+    точки ячейки округления. Записи старше ttl секунд считаются устаревшими;
+    записи, вычисленные на предыдущем снимке геозон, не выдаются.
+
+    Возвращаемые из кэша списки общие для всех вызовов, изменять их нельзя.
+    """
+
+    def __init__(self, maxsize: int = 100_000, ttl: Optional[float] = None, precision: int = 5):
+        if maxsize <= 0:
+            raise ValueError("Размер кэша должен быть положительным")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.precision = precision
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, kind: str, lat: float, lon: float) -> Optional[Tuple[str, int, int]]:
+        """Ключ записи или None для нечисловых координат (такие точки не кэшируются)."""
+        scale = 10 ** self.precision
+        lat, lon = lat * scale, lon * scale
+        if not (math.isfinite(lat) and math.isfinite(lon)):
+            return None
+        return kind, int(round(lat)), int(round(lon))
+
+    def get(self, kind: str, lat: float, lon: float, data) -> Tuple[bool, object]:
+        """
+        Ищет результат, вычисленный на снимке data.
+
+        Returns:
+            Кортеж (найдено, результат)
+        """
+        key = self._key(kind, lat, lon)
+        if key is None:
+            return False, None
+        with self._lock:
+            entry = self._entries.get(key)
+            if (entry is None or entry[0] is not data
+                    or (entry[1] is not None and time.monotonic() > entry[1])):
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[2]
+
+    def set(self, kind: str, lat: float, lon: float, data, result):
+        """Сохраняет результат, вытесняя самую давно использованную запись."""
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        key = self._key(kind, lat, lon)
+        if key is None:
+            return
+        with self._lock:
+            self._entries[key] = (data, expires, result)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Удаляет все записи (счетчики попаданий сохраняются)."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Счетчики попаданий и промахов."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+
 class RTEZoneChecker:
     """Класс для работы с геозонами доставки ресторанов"""
 
-    def __init__(self, polygons_file: str):
+    geocoder_url = "https://nominatim.openstreetmap.org/reverse"
+
+    def __init__(self, polygons_file: str, snapshot_file: Optional[str] = None,
+                 geocode_cache: Optional[GeocodeCache] = None,
+                 result_cache: Optional[ResultCache] = None, compact: bool = False,
+                 key_columns: Optional[List[str]] = None):
         """
         Инициализация класса для работы с геозонами.
 
         Args:
             polygons_file: путь к файлу с полигонами (Excel или CSV)
+            snapshot_file: путь к бинарному снимку (.npz). Если снимок актуален,
+                данные читаются из него; иначе он пересоздается из polygons_file
+            geocode_cache: постоянный кэш обратного геокодирования
+            result_cache: кэш результатов point_in_zones и
+                get_restaurants_for_point; очищается при смене данных
+            compact: компактный режим - WKT разобранных геозон не хранится
+                (и не попадает в результаты point_in_zones), строковые колонки
+                хранятся как category. Сравнение версий файла (apply_file_diff)
+                в этом режиме недоступно
+            key_columns: колонки, загружаемые сразу (например, LOOKUP_COLUMNS).
+                Остальные колонки, включая WKT после разбора, читаются из
+                snapshot_file (или временного файла) при первом обращении.
+                По умолчанию загружаются все колонки
         """
         self.polygons_file = polygons_file
-        self.df = None
-        self.gdf = None
+        self.snapshot_file = snapshot_file
+        self.geocode_cache = geocode_cache
+        self.result_cache = result_cache
+        self.compact = compact
+        self.key_columns = key_columns
+        self._data = None
+        self._reload_lock = threading.Lock()
+        self._watcher = None
+        self._watcher_stop = None
+        self._city_index = None
+        self._city_names = None
+        self._city_areas = None
+        self._coverage_cell_size = None
         self.load_data()
 
+    @property
+    def df(self) -> Optional[pd.DataFrame]:
+        """Исходная таблица из файла полигонов (отложенные колонки загружаются)."""
+        return self._materialized().df if self._data is not None else None
+
+    @property
+    def gdf(self) -> Optional[gpd.GeoDataFrame]:
+        """GeoDataFrame успешно разобранных геозон (отложенные колонки загружаются)."""
+        return self._materialized().gdf if self._data is not None else None
+
+    @property
+    def load_errors(self) -> List[dict]:
+        """Пустые и некорректные строки WKT последней загрузки."""
+        return self._data.load_errors if self._data is not None else []
+
+    def _require_data(self) -> _ZoneData:
+        """Возвращает текущий снимок данных; вызывающий код работает с ним до конца."""
+        data = self._data
+        if data is None:
+            raise ValueError("Данные не загружены")
+        return data
+
+    def _materialized(self) -> _ZoneData:
+        """Текущий снимок со всеми загруженными колонками."""
+        data = self._require_data()
+        data.load_columns()
+        return data
+
     def load_data(self):
-        """Загружает данные из файла и создает GeoDataFrame"""
+        """
+        Загружает данные из файла (или актуального снимка) и создает GeoDataFrame.
+
+        Таблицы и индекс строятся целиком и подменяют текущие одним
+        присваиванием, поэтому вызов на работающем объекте безопасен.
+        """
         try:
-            if self.polygons_file.endswith('.xlsx'):
-                self.df = pd.read_excel(self.polygons_file)
-            elif self.polygons_file.endswith('.csv'):
-                self.df = pd.read_csv(self.polygons_file)
+            stamp = _file_stamp(self.polygons_file)
+
+            data = None
+            if self.snapshot_file:
+                data = self._read_snapshot(self.snapshot_file, stamp, self.key_columns)
+                if data is not None:
+                    print(f"Загружено {len(data.gdf)} геозон из снимка {self.snapshot_file}")
+
+            if data is None and self.snapshot_file:
+                data = self._read_source(stamp)
+                snapshot = self._write_snapshot(self.snapshot_file, data)
+                if self.key_columns is not None:
+                    lazy = [col for col in data.df.columns if col not in self.key_columns]
+                    if snapshot is not None:
+                        data.defer_columns(lazy, self._npz_column_loader(snapshot))
+                    else:
+                        self._spill_columns(data, lazy)
+                elif snapshot is not None:
+                    snapshot.close()
+
+            if data is None:
+                data = self._read_source(stamp, self.key_columns)
+
+            self._set_data(data)
+
+        except Exception as e:
+            print(f"Ошибка при загрузке данных: {e}")
+            raise
+
+    def _set_data(self, data: _ZoneData, changed_bounds: Optional[np.ndarray] = None):
+        """
+        Достраивает производные структуры нового снимка и подменяет текущий.
+
+        Args:
+            changed_bounds: bounding box геозон, измененных относительно текущего
+                снимка (инкрементальные изменения); сетка покрытия тогда
+                пересчитывается только в них
+        """
+        if self.compact:
+            data.make_compact()
+        if self._coverage_cell_size is not None:
+            previous = self._data.coverage if self._data is not None else None
+            if (changed_bounds is not None and previous is not None
+                    and previous.cell_size == self._coverage_cell_size):
+                data.coverage = previous.updated(data.index, changed_bounds)
             else:
-                raise ValueError("Поддерживаются только файлы .xlsx и .csv")
+                data.coverage = _CoverageGrid(data.index, self._coverage_cell_size)
+        if not any(col in data.lazy_columns for col in ('ID реста', 'Партнер')):
+            data.restaurant_index()
+        self._data = data
+        if self.result_cache is not None:
+            self.result_cache.clear()
+
+    def enable_coverage_grid(self, cell_size: Optional[float] = 0.005):
+        """
+        Включает предвычисленную сетку покрытия для is_point_in_any_zone.
+
+        Точки во внутренних и внешних ячейках сетки проверяются за O(1),
+        до точной проверки доходят только точки граничных ячеек. Сетка
+        пересобирается при каждой перезагрузке; при инкрементальных
+        изменениях (apply_zone_changes) пересчитываются только ячейки
+        измененных геозон.
+
+        Args:
+            cell_size: размер ячейки в градусах (0.005 - около 550 м по широте);
+                None отключает сетку
+        """
+        with self._reload_lock:
+            data = self._require_data()
+            if cell_size is None:
+                self._coverage_cell_size = None
+                data.coverage = None
+                return
+            start = time.perf_counter()
+            # Размер запоминается только для построенной сетки, иначе с ним падали бы все перезагрузки
+            coverage = _CoverageGrid(data.index, cell_size)
+            self._coverage_cell_size = cell_size
+            data.coverage = coverage
+            print(f"Сетка покрытия {cell_size}°: внутренних ячеек {coverage.inside_cells}, "
+                  f"граничных {coverage.boundary_cells}, "
+                  f"построена за {time.perf_counter() - start:.2f} с")
+
+    @staticmethod
+    def _read_table(path: str) -> pd.DataFrame:
+        """Читает таблицу полигонов (Excel или CSV) без разбора геометрий."""
+        if path.endswith('.xlsx'):
+            df = pd.read_excel(path)
+        elif path.endswith('.csv'):
+            df = pd.read_csv(path)
+        else:
+            raise ValueError("Поддерживаются только файлы .xlsx и .csv")
+
+        print(f"Загружено {len(df)} записей")
+        print("Колонки в файле:", list(df.columns))
+
+        if 'WKT' not in df.columns:
+            raise ValueError("В файле не найдена колонка 'WKT'")
+        return df
+
+    @staticmethod
+    def _spill_columns(data: _ZoneData, columns: List[str]):
+        """
+        Откладывает колонки, выгрузив их во временный npz.
+
+        Исходный файл может измениться до первого обращения к колонкам,
+        поэтому они сохраняются в момент загрузки в анонимный временный
+        файл (исчезает вместе с последним дескриптором); если записать его
+        не удалось, колонки остаются в памяти.
+        """
+        columns = [col for col in columns if col in data.df.columns]
+        if not columns:
+            return
+        meta = {
+            'n_rows': len(data.df),
+            'columns': columns,
+            'dtypes': [str(data.df[col].dtype) for col in columns],
+        }
+        arrays = {f'col_{i}': _encode_column(data.df[col]) for i, col in enumerate(columns)}
+        arrays['meta'] = np.frombuffer(json.dumps(meta, ensure_ascii=False).encode('utf-8'), dtype=np.uint8)
+        try:
+            with tempfile.TemporaryFile(prefix='rte_zones_', suffix='.npz') as f:
+                np.savez(f, **arrays)
+                f.flush()
+                spilled = _PinnedFile(os.dup(f.fileno()))
+        except OSError as e:
+            print(f"Предупреждение: не удалось выгрузить отложенные колонки: {e}")
+            return
+
+        data.defer_columns(columns, RTEZoneChecker._npz_column_loader(spilled))
+
+    @staticmethod
+    def _npz_column_loader(npz: _PinnedFile):
+        """
+        Загрузчик отложенных колонок из открытого npz (снимка или временного
+        файла); читаются только нужные массивы.
+        """
+        def load(columns: List[str]) -> pd.DataFrame:
+            with np.load(npz, allow_pickle=False) as arrays:
+                meta = json.loads(arrays['meta'].tobytes().decode('utf-8'))
+                dtypes = dict(zip(meta['columns'], meta['dtypes']))
+                return pd.DataFrame(
+                    {col: _decode_column(arrays[f"col_{meta['columns'].index(col)}"], dtypes[col]) for col in columns},
+                    index=pd.RangeIndex(meta['n_rows']),
+                )
+        return load
+
+    def _read_source(self, stamp: Tuple[int, int], key_columns: Optional[List[str]] = None) -> _ZoneData:
+        """
+        Читает и разбирает исходный файл полигонов (Excel или CSV).
+
+        Если заданы key_columns, остальные колонки (и WKT после разбора)
+        откладываются до первого обращения.
+        """
+        df = self._read_table(self.polygons_file)
+
+        valid_positions, geometries, load_errors = self._parse_geometries(df)
+
+        valid_df = df.iloc[valid_positions].copy()
+        gdf = gpd.GeoDataFrame(valid_df, geometry=geometries, crs='EPSG:4326')
+        data = _ZoneData(df, gdf, load_errors, stamp)
+        if key_columns is not None:
+            self._spill_columns(data, [col for col in df.columns if col not in key_columns])
+
+        print(f"Успешно обработано {len(gdf)} геозон")
+        if load_errors:
+            empty = sum(1 for error in load_errors if error['error'] == 'empty')
+            print(f"Пропущено {len(load_errors)} строк: пустых WKT {empty}, "
+                  f"с ошибкой разбора {len(load_errors) - empty} (подробности в load_errors)")
 
-            print(f"Загружено {len(self.df)} записей")
-            print("Колонки в файле:", list(self.df.columns))
+        return data
 
-            if 'WKT' not in self.df.columns:
-                raise ValueError("В файле не найдена колонка 'WKT'")
+    def reload(self, background: bool = False) -> Optional[threading.Thread]:
+        """
+        Перечитывает файл полигонов без остановки обслуживания.
+
+        Новые таблицы и индекс строятся вне горячего пути и подменяются
+        атомарно; вызовы point_in_zones и другие, начатые до подмены,
+        завершаются на старом снимке. При ошибке загрузки остаются старые данные.
+
+        Args:
+            background: выполнить перезагрузку в фоновом потоке и сразу вернуть его
+        """
+        if background:
+            thread = threading.Thread(target=self.reload, name='rte-zones-reload', daemon=True)
+            thread.start()
+            return thread
+
+        with self._reload_lock:
+            self.load_data()
+        return None
 
-            geometries = []
-            valid_indices = []
+    def reload_if_changed(self) -> bool:
+        """
+        Перезагружает данные, если у файла полигонов изменились mtime или размер.
 
-            for idx, wkt_string in enumerate(self.df['WKT']):
+        Returns:
+            True, если данные были перезагружены
+        """
+        with self._reload_lock:
+            data = self._data
+            if data is not None and data.source_stamp == _file_stamp(self.polygons_file):
+                return False
+            self.load_data()
+            return True
+
+    def start_auto_reload(self, interval: float = 60.0):
+        """Запускает фоновый поток, который раз в interval секунд вызывает reload_if_changed."""
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+
+        stop = threading.Event()
+
+        def watch():
+            while not stop.wait(interval):
                 try:
-                    if pd.notna(wkt_string):
-                        geom = loads(wkt_string)
-                        geometries.append(geom)
-                        valid_indices.append(idx)
-                    else:
-                        print(f"Пустая WKT строка в индексе {idx}")
+                    self.reload_if_changed()
                 except Exception as e:
-                    print(f"Ошибка парсинга WKT в индексе {idx}: {e}")
+                    print(f"Ошибка фоновой перезагрузки геозон: {e}")
+
+        self._watcher_stop = stop
+        self._watcher = threading.Thread(target=watch, name='rte-zones-watcher', daemon=True)
+        self._watcher.start()
+
+    def stop_auto_reload(self):
+        """Останавливает фоновую проверку файла полигонов."""
+        if self._watcher is not None:
+            self._watcher_stop.set()
+            self._watcher.join()
+            self._watcher = None
 
-            valid_df = self.df.iloc[valid_indices].copy()
-            self.gdf = gpd.GeoDataFrame(valid_df, geometry=geometries, crs='EPSG:4326')
+    def apply_zone_changes(self, upserts=None, removals=None) -> dict:
+        """
+        Инкрементально добавляет, заменяет и удаляет геозоны без полной перезагрузки.
+
+        Геозона определяется ключом ZONE_KEY_COLUMNS ('ID внутренний', 'name').
+        Разбираются только WKT переданных строк; геометрии остальных геозон
+        переиспользуются вместе с подготовленными структурами, а STRtree
+        (в shapely он неизменяемый) пересобирается пакетно по готовым
+        геометриям - это доли миллисекунды на тысячи зон. Новый снимок
+        подменяет текущий атомарно, как при reload; если изменений нет,
+        текущий снимок остается. Строки с пустыми или некорректными WKT
+        пропускаются и попадают в load_errors, как при полной загрузке.
+
+        Args:
+            upserts: строки (DataFrame или список словарей) в формате файла
+                полигонов. Все геозоны с тем же ключом заменяются этими
+                строками, строки с новым ключом добавляются
+            removals: удаляемые геозоны: 'ID внутренний' (все зоны точки)
+                или кортеж ('ID внутренний', 'name')
+
+        Returns:
+            Словарь с числом добавленных, замененных и удаленных строк.
+            Сохраненные геозоны сохраняют свой 'index', новые и замененные
+            получают новые значения.
+        """
+        with self._reload_lock:
+            return self._apply_zone_changes(upserts, removals)
+
+    def _apply_zone_changes(self, upserts, removals, stamp: Optional[Tuple[int, int]] = None) -> dict:
+        """Реализация apply_zone_changes; вызывается под self._reload_lock."""
+        data = self._materialized()
+        df = data.df
+
+        missing = [col for col in ZONE_KEY_COLUMNS if col not in df.columns]
+        if missing:
+            raise ValueError(f"В данных нет ключевых колонок {missing}")
+
+        upserts = pd.DataFrame(upserts if upserts is not None else [])
+        if len(upserts):
+            missing = [col for col in ['WKT'] + ZONE_KEY_COLUMNS if col not in upserts.columns]
+            if missing:
+                raise ValueError(f"В изменениях нет колонок {missing}")
+        else:
+            upserts = df.iloc[0:0]
+
+        removed_ids = {item for item in (removals or []) if not isinstance(item, tuple)}
+        removed_pairs = [item for item in (removals or []) if isinstance(item, tuple)]
 
-            print(f"Успешно обработано {len(self.gdf)} геозон")
+        df_keys = pd.MultiIndex.from_frame(df[ZONE_KEY_COLUMNS])
+        replaced = df_keys.isin(pd.MultiIndex.from_frame(upserts[ZONE_KEY_COLUMNS]))
+        removed = df[ZONE_KEY_COLUMNS[0]].isin(removed_ids).to_numpy() & ~replaced
+        if removed_pairs:
+            removed |= df_keys.isin(removed_pairs) & ~replaced
 
+        stats = {
+            'added': len(upserts) - int(pd.MultiIndex.from_frame(upserts[ZONE_KEY_COLUMNS]).isin(df_keys).sum()),
+            'replaced': int(replaced.sum()),
+            'removed': int(removed.sum()),
+        }
+        if not len(upserts) and not replaced.any() and not removed.any():
+            # Изменений нет: текущий снимок, индекс и кэши остаются прежними
+            if stamp is not None:
+                data.source_stamp = stamp
+            print("Изменений в геозонах нет")
+            return stats
+
+        start = int(df.index.max()) + 1 if len(df) else 0
+        upserts = upserts.set_axis(pd.RangeIndex(start, start + len(upserts)))
+        new_df = pd.concat([df[~(replaced | removed)], upserts])
+
+        # Пустые и некорректные WKT, как и при полной загрузке, попадают в load_errors
+        valid_positions, geometries, errors = self._parse_geometries(upserts)
+        kept_gdf = data.gdf[data.gdf.index.isin(new_df.index)]
+        added_gdf = gpd.GeoDataFrame(upserts.iloc[valid_positions].copy(), geometry=geometries, crs='EPSG:4326')
+        new_gdf = pd.concat([kept_gdf, added_gdf]) if len(added_gdf) else kept_gdf.copy()
+
+        load_errors = [error for error in data.load_errors if error['index'] in new_df.index] + errors
+        dropped = ~data.gdf.index.isin(new_df.index)
+        changed_bounds = np.vstack([shapely.bounds(data.index.geometries[dropped]),
+                                    shapely.bounds(np.asarray(geometries, dtype=object))])
+        self._set_data(_ZoneData(new_df, new_gdf, load_errors, stamp or data.source_stamp), changed_bounds)
+        if errors:
+            print(f"Пропущено {len(errors)} строк с пустыми или некорректными WKT (подробности в load_errors)")
+        print(f"Изменения применены: добавлено {stats['added']}, "
+              f"заменено {stats['replaced']}, удалено {stats['removed']} строк")
+        return stats
+
+    def apply_file_diff(self, new_file: Optional[str] = None) -> dict:
+        """
+        Сравнивает новую версию файла полигонов с загруженными данными
+        и применяет только изменившиеся геозоны через apply_zone_changes.
+
+        Геозоны сравниваются по ключу ZONE_KEY_COLUMNS и хэшам строк всех
+        колонок (с учетом повторяющихся ключей).
+
+        Args:
+            new_file: новая версия файла; по умолчанию self.polygons_file
+
+        Returns:
+            Статистика изменений, как у apply_zone_changes
+        """
+        if self.compact:
+            raise ValueError("Сравнение версий файла недоступно в компактном режиме: WKT не хранится")
+        path = new_file or self.polygons_file
+        with self._reload_lock:
+            stamp = _file_stamp(path) if path == self.polygons_file else None
+            new_df = self._read_table(path)
+            data = self._materialized()
+
+            old_signatures = self._key_signatures(data.df, new_df.columns)
+            new_signatures = self._key_signatures(new_df, new_df.columns)
+
+            changed = [key for key, signature in new_signatures.items() if old_signatures.get(key) != signature]
+            removals = [key for key in old_signatures if key not in new_signatures]
+
+            new_keys = pd.MultiIndex.from_frame(new_df[ZONE_KEY_COLUMNS])
+            upserts = new_df[new_keys.isin(changed)]
+            return self._apply_zone_changes(upserts, removals, stamp)
+
+    @staticmethod
+    def _key_signatures(df: pd.DataFrame, columns) -> dict:
+        """Для каждого ключа геозоны - отсортированный кортеж хэшей ее строк."""
+        hashes = pd.util.hash_pandas_object(df.reindex(columns=columns), index=False).to_numpy()
+        signatures = {}
+        for key, row_hash in zip(zip(*(df[col] for col in ZONE_KEY_COLUMNS)), hashes):
+            signatures.setdefault(key, []).append(row_hash)
+        return {key: tuple(sorted(values)) for key, values in signatures.items()}
+
+    def _parse_geometries(self, df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray, List[dict]]:
+        """
+        Разбирает колонку WKT одним векторизованным вызовом shapely.from_wkt.
+
+        Пустые и некорректные строки не прерывают загрузку, а возвращаются
+        в отчете об ошибках как словари с ключами 'index', 'error'
+        ('empty' или 'invalid') и 'message'.
+
+        Returns:
+            Кортеж (позиции успешно разобранных строк, их геометрии, ошибки)
+        """
+        wkt = df['WKT']
+        blank = (wkt.isna() | (wkt.astype(str).str.strip() == '')).to_numpy()
+
+        values = wkt.astype(str).to_numpy(dtype=object, copy=True)
+        values[blank] = None
+        geometries = shapely.from_wkt(values, on_invalid='ignore')
+        invalid = shapely.is_missing(geometries) & ~blank
+
+        load_errors = []
+        for pos in np.flatnonzero(blank | invalid):
+            error = {'index': df.index[pos], 'error': 'empty', 'message': 'Пустая WKT строка'}
+            if invalid[pos]:
+                error['error'] = 'invalid'
+                try:
+                    shapely.from_wkt(values[pos])
+                except Exception as e:
+                    error['message'] = str(e)
+            load_errors.append(error)
+
+        valid_positions = np.flatnonzero(~(blank | invalid))
+        return valid_positions, geometries[valid_positions], load_errors
+
+    def _write_snapshot(self, path: str, data: _ZoneData) -> Optional[_PinnedFile]:
+        """
+        Сохраняет атрибуты и геометрии (WKB) в бинарный снимок.
+
+        Снимок помечается отпечатком исходного файла (mtime, размер) и
+        записывается атомарно через временный файл.
+
+        Returns:
+            Открытый записанный снимок (из него читаются отложенные колонки,
+            даже если файл затем перезапишет другой процесс) или None, если
+            записать не удалось; ошибка записи не прерывает загрузку
+        """
+        columns = list(data.df.columns)
+        meta = {
+            'version': SNAPSHOT_VERSION,
+            'source_stamp': list(data.source_stamp),
+            'n_rows': len(data.df),
+            'columns': columns,
+            'dtypes': [str(dtype) for dtype in data.df.dtypes],
+            'load_errors': data.load_errors,
+        }
+
+        wkb = shapely.to_wkb(data.index.geometries)
+        wkb_offsets = np.zeros(len(wkb) + 1, dtype=np.int64)
+        np.cumsum([len(item) for item in wkb], out=wkb_offsets[1:])
+
+        arrays = {
+            'meta': np.frombuffer(json.dumps(meta, ensure_ascii=False, default=_json_default).encode('utf-8'), dtype=np.uint8),
+            'valid_positions': data.df.index.get_indexer(data.gdf.index).astype(np.int64),
+            'wkb': np.frombuffer(b''.join(wkb), dtype=np.uint8),
+            'wkb_offsets': wkb_offsets,
+        }
+        for i, col in enumerate(columns):
+            arrays[f'col_{i}'] = _encode_column(data.df[col])
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, **arrays)
+            snapshot = _PinnedFile(os.open(tmp_path, os.O_RDONLY))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            # Снимок - только кэш: без него данные остаются загруженными из исходного файла
+            print(f"Предупреждение: не удалось сохранить снимок {path}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return None
+
+        print(f"Снимок сохранен в {path}")
+        return snapshot
+
+    def _read_snapshot(self, path: str, stamp: Tuple[int, int],
+                       key_columns: Optional[List[str]] = None) -> Optional[_ZoneData]:
+        """
+        Читает снимок, если он существует и соответствует файлу полигонов.
+
+        Если заданы key_columns, из снимка читаются только эти колонки,
+        остальные откладываются до первого обращения.
+
+        Returns:
+            Данные из снимка или None, если снимок отсутствует или устарел
+        """
+        if not os.path.exists(path):
+            return None
+
+        # Отложенные колонки читаются из этого же открытого файла: снимок по
+        # пути может перезаписать другой процесс для новой версии полигонов
+        snapshot = None
+        try:
+            snapshot = _PinnedFile(os.open(path, os.O_RDONLY))
+            with np.load(snapshot, allow_pickle=False) as data:
+                meta = json.loads(data['meta'].tobytes().decode('utf-8'))
+                if meta.get('version') != SNAPSHOT_VERSION or meta.get('source_stamp') != list(stamp):
+                    print(f"Снимок {path} устарел, исходный файл будет перечитан")
+                    snapshot.close()
+                    return None
+
+                columns = {
+                    col: _decode_column(data[f'col_{i}'], dtype)
+                    for i, (col, dtype) in enumerate(zip(meta['columns'], meta['dtypes']))
+                    if key_columns is None or col in key_columns
+                }
+                valid_positions = data['valid_positions']
+                wkb = data['wkb'].tobytes()
+                offsets = data['wkb_offsets']
         except Exception as e:
-            print(f"Ошибка при загрузке данных: {e}")
-            raise
+            print(f"Не удалось прочитать снимок {path}: {e}")
+            if snapshot is not None:
+                snapshot.close()
+            return None
+
+        geometries = shapely.from_wkb([wkb[start:end] for start, end in zip(offsets[:-1], offsets[1:])])
 
-    def point_in_zones(self, lat: float, lon: float) -> List[dict]:
+        df = pd.DataFrame(columns, index=pd.RangeIndex(meta['n_rows']))
+        valid_df = df.iloc[valid_positions].copy()
+        gdf = gpd.GeoDataFrame(valid_df, geometry=geometries, crs='EPSG:4326')
+        zone_data = _ZoneData(df, gdf, meta['load_errors'], stamp)
+        if key_columns is not None:
+            lazy = [col for col in meta['columns'] if col not in key_columns]
+            zone_data.defer_columns(lazy, self._npz_column_loader(snapshot), meta['columns'])
+        else:
+            snapshot.close()
+        return zone_data
+
+    def point_in_zones(self, lat: float, lon: float, include_geometry: bool = True) -> List[dict]:
         """
         Проверяет, попадает ли точка в какие-либо геозоны.
 
         Args:
             lat: широта точки
             lon: долгота точки
+            include_geometry: включать ли в результат geometry и WKT
 
         Returns:
             Список словарей с информацией о геозонах, в которые попадает точка
         """
-        if self.gdf is None:
-            raise ValueError("Данные не загружены")
-
-        point = Point(lon, lat)  # Shapely использует (lon, lat)
-        intersecting = self.gdf[self.gdf.geometry.contains(point)]
-
-        results = []
-        for idx, row in intersecting.iterrows():
-            result = {
-                'index': idx,
-                'geometry': row.geometry,
-            }
-            for col in self.gdf.columns:
-                if col != 'geometry':
-                    result[col] = row[col]
-            results.append(result)
+        if include_geometry:
+            return self._cached_lookup('zones', lat, lon, self._zones_for_point)
+        return self._cached_lookup('zone_attributes', lat, lon, self._zone_attributes_for_point)
+
+    @staticmethod
+    def _zones_for_point(data: _ZoneData, lat: float, lon: float) -> List[dict]:
+        return ZoneMatches(data, data.index.query_point(lat, lon)).to_dicts()
+
+    @staticmethod
+    def _zone_attributes_for_point(data: _ZoneData, lat: float, lon: float) -> List[dict]:
+        return ZoneMatches(data, data.index.query_point(lat, lon)).to_dicts(include_geometry=False)
+
+    def _cached_lookup(self, kind: str, lat: float, lon: float, lookup) -> List[dict]:
+        """Выполняет lookup(data, lat, lon) через result_cache, если он задан."""
+        data = self._require_data()
+        cache = self.result_cache
+        if cache is None:
+            return lookup(data, lat, lon)
+
+        found, result = cache.get(kind, lat, lon, data)
+        if not found:
+            result = lookup(data, lat, lon)
+            cache.set(kind, lat, lon, data, result)
+        return result
+
+    def zone_matches(self, lat: float, lon: float) -> ZoneMatches:
+        """
+        Облегченный вариант point_in_zones: возвращает ZoneMatches с позициями
+        геозон вместо списка словарей.
 
-        return results
+        Пример:
+            matches = checker.zone_matches(lat, lon)
+            ids = matches['ID реста']
+        """
+        data = self._require_data()
+        return ZoneMatches(data, data.index.query_point(lat, lon))
 
     def is_point_in_any_zone(self, lat: float, lon: float) -> bool:
         """
         Простая проверка - попадает ли точка в любую геозону.
+
+        Останавливается на первой геозоне, содержащей точку, и не строит
+        словари результатов, как point_in_zones. Если включена сетка покрытия
+        (enable_coverage_grid), точная проверка выполняется только для
+        граничных ячеек.
+        """
+        data = self._require_data()
+        if data.coverage is not None:
+            state = data.coverage.classify(lat, lon)
+            if state is not None:
+                return state
+        return data.index.contains_any(lat, lon)
+
+    def point_in_zones_many(self, lats, lons=None) -> Tuple[np.ndarray, np.ndarray]:
         """
-        results = self.point_in_zones(lat, lon)
-        return len(results) > 0
+        Пакетная проверка попадания множества точек в геозоны.
+
+        Все точки обрабатываются одним векторизованным запросом к индексу
+        без цикла на Python.
+
+        Args:
+            lats: массив широт или DataFrame с колонками 'lat' и 'lon'
+            lons: массив долгот (не нужен, если передан DataFrame)
+
+        Returns:
+            Кортеж (point_idx, zone_idx) массивов одинаковой длины: точка
+            с позицией point_idx попадает в геозону zone_idx (значение 'index'
+            из point_in_zones). Пары отсортированы по точкам, затем по геозонам.
+        """
+        data = self._require_data()
+
+        if isinstance(lats, pd.DataFrame):
+            lats, lons = lats['lat'], lats['lon']
+        elif lons is None:
+            raise ValueError("Не переданы долготы точек")
+
+        lats = np.atleast_1d(np.asarray(lats, dtype=float))
+        lons = np.atleast_1d(np.asarray(lons, dtype=float))
+        if lats.shape != lons.shape or lats.ndim != 1:
+            raise ValueError("Широты и долготы должны быть одномерными массивами одной длины")
+
+        point_idx, zone_pos = data.index.query_points(lats, lons)
+        return point_idx, data.gdf.index.values[zone_pos]
 
     def get_restaurants_for_point(self, lat: float, lon: float) -> List[dict]:
         """
         Получает список ресторанов, которые доставляют в указанную точку.
         """
-        zones = self.point_in_zones(lat, lon)
-        restaurants = {}
+        return self._cached_lookup('restaurants', lat, lon, self._restaurants_for_point)
+
+    @staticmethod
+    def _restaurants_for_point(data: _ZoneData, lat: float, lon: float) -> List[dict]:
+        restaurant_codes, restaurant_ids, zone_partners = data.restaurant_index()
+        positions = data.index.query_point(lat, lon)
+        codes = restaurant_codes[positions].tolist()
+        partners = zone_partners[positions]
+        names = data.optional_column_values('name', 'Неизвестная зона')[positions]
+        internal_ids = data.optional_column_values('ID внутренний', '')[positions]
+        indices = data.gdf.index.values[positions].tolist()
 
-        for zone in zones:
-            restaurant_id = zone.get('ID реста', 'unknown')
-            partner = zone.get('Партнер', 'Неизвестно')
-            zone_name = zone.get('name', 'Неизвестная зона')
-
-            if restaurant_id not in restaurants:
-                restaurants[restaurant_id] = {
-                    'restaurant_id': restaurant_id,
+        restaurants = {}
+        for code, partner, zone_name, internal_id, idx in zip(codes, partners, names, internal_ids, indices):
+            if code not in restaurants:
+                restaurants[code] = {
+                    'restaurant_id': restaurant_ids[code],
                     'partner': partner,
                     'zones': []
                 }
 
-            restaurants[restaurant_id]['zones'].append({
+            restaurants[code]['zones'].append({
                 'name': zone_name,
-                'internal_id': zone.get('ID внутренний', ''),
-                'index': zone['index']
+                'internal_id': internal_id,
+                'index': idx
             })
 
         return list(restaurants.values())
 
+    def nearest_zones(self, lat: float, lon: float, k: int = 5,
+                      max_distance_m: Optional[float] = None) -> List[dict]:
+        """
+        Ближайшие к точке геозоны с расстоянием до них в метрах.
+
+        Кандидаты отбираются пространственным индексом, расстояния считаются
+        в локальной проекции с центром в точке. Геозоны, содержащие точку,
+        имеют расстояние 0.
+
+        Args:
+            lat: широта точки
+            lon: долгота точки
+            k: максимальное число геозон
+            max_distance_m: не дальше этого расстояния; без ограничения, если None
+
+        Returns:
+            Список словарей в формате point_in_zones без geometry и WKT
+            с дополнительным ключом 'distance_m', по возрастанию расстояния
+        """
+        data = self._require_data()
+        index = data.index
+        # Для нечисловых координат индекс не находит ближайших, как и point_in_zones
+        if k <= 0 or len(data.gdf) == 0 or not (math.isfinite(lat) and math.isfinite(lon)):
+            return []
+
+        if max_distance_m is not None:
+            radius = max_distance_m
+        else:
+            # Ближайший по градусам полигон не дальше nearest * (метров в градусе широты)
+            _, nearest = index.tree.query_nearest(Point(lon, lat), return_distance=True)
+            radius = max(float(nearest[0]) * _meters_per_degree(lat)[1], 1.0)
+
+        while True:
+            candidates = index.candidates_within(lat, lon, radius)
+            distances = index.distances_m(lat, lon, candidates)
+            found = distances <= radius
+            if max_distance_m is not None or found.sum() >= k or len(candidates) == len(data.gdf):
+                break
+            radius *= 2
+
+        positions, distances = candidates[found], distances[found]
+        order = np.lexsort((positions, distances))[:k]
+        results = ZoneMatches(data, positions[order]).to_dicts(include_geometry=False)
+        for result, distance in zip(results, distances[order].tolist()):
+            result['distance_m'] = distance
+        return results
+
+    def zones_in_bbox(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> np.ndarray:
+        """
+        Геозоны, пересекающие прямоугольник (например, видимую область карты).
+
+        Returns:
+            Массив значений 'index' геозон по возрастанию позиций
+        """
+        if min_lat > max_lat or min_lon > max_lon:
+            raise ValueError("Минимальные координаты прямоугольника больше максимальных")
+        data = self._require_data()
+        positions = data.index.tree.query(shapely.box(min_lon, min_lat, max_lon, max_lat), predicate='intersects')
+        return data.gdf.index.values[np.sort(positions)]
+
+    def zones_in_bboxes(self, min_lats, min_lons, max_lats, max_lons) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Пакетный вариант zones_in_bbox для множества прямоугольников одним запросом к индексу.
+
+        Returns:
+            Кортеж (bbox_idx, zone_idx), как у point_in_zones_many
+        """
+        min_lats, min_lons = np.asarray(min_lats, dtype=float), np.asarray(min_lons, dtype=float)
+        max_lats, max_lons = np.asarray(max_lats, dtype=float), np.asarray(max_lons, dtype=float)
+        if np.any(min_lats > max_lats) or np.any(min_lons > max_lons):
+            raise ValueError("Минимальные координаты прямоугольника больше максимальных")
+        boxes = shapely.box(min_lons, min_lats, max_lons, max_lats)
+        data = self._require_data()
+        bbox_idx, positions = data.index.tree.query(np.atleast_1d(boxes), predicate='intersects')
+        order = np.lexsort((positions, bbox_idx))
+        return bbox_idx[order], data.gdf.index.values[positions[order]]
+
+    def zones_within_radius(self, lat: float, lon: float, meters: float) -> np.ndarray:
+        """
+        Геозоны, пересекающие круг радиусом meters метров вокруг точки.
+
+        Кандидаты отбираются индексом по описанному квадрату, затем
+        проверяется расстояние в локальной проекции (как в nearest_zones).
+
+        Returns:
+            Массив значений 'index' геозон по возрастанию позиций
+        """
+        if meters < 0:
+            raise ValueError("Радиус должен быть неотрицательным")
+        data = self._require_data()
+        candidates = np.sort(data.index.candidates_within(lat, lon, meters))
+        if len(candidates) == 0:
+            return data.gdf.index.values[candidates]
+        inside = data.index.distances_m(lat, lon, candidates) <= meters
+        return data.gdf.index.values[candidates[inside]]
+
+    def distance_to_boundary(self, lat: float, lon: float, zone_index) -> float:
+        """
+        Расстояние в метрах от точки до границы геозоны.
+
+        Args:
+            lat: широта точки
+            lon: долгота точки
+            zone_index: значение 'index' геозоны (как в point_in_zones)
+
+        Returns:
+            Положительное расстояние, если точка снаружи геозоны,
+            отрицательное - если внутри
+        """
+        data = self._require_data()
+        try:
+            position = data.gdf.index.get_loc(zone_index)
+        except KeyError:
+            raise ValueError(f"Геозона с индексом {zone_index} не найдена")
+        if not isinstance(position, (int, np.integer)):
+            raise ValueError(f"Индекс геозоны {zone_index} не уникален")
+
+        positions = np.array([position])
+        distance = float(data.index.distances_m(lat, lon, positions, boundary=True)[0])
+        inside = data.index.geometries[position].contains(Point(lon, lat))
+        return -distance if inside else distance
+
+    def load_city_boundaries(self, boundaries_file: str, name_column: str = 'name'):
+        """
+        Загружает локальный файл границ городов для офлайн-определения города.
+
+        После загрузки get_city_from_coordinates и add_city_column определяют
+        город проверкой попадания точки в полигон без запросов к геокодеру.
+
+        Args:
+            boundaries_file: GeoJSON, GeoPackage, Shapefile или GeoParquet
+            name_column: колонка с названием города
+        """
+        if boundaries_file.endswith('.parquet'):
+            cities = gpd.read_parquet(boundaries_file)
+        else:
+            cities = gpd.read_file(boundaries_file)
+
+        if name_column not in cities.columns:
+            raise ValueError(f"В файле границ не найдена колонка '{name_column}'")
+        if cities.crs is not None and not cities.crs.equals('EPSG:4326'):
+            cities = cities.to_crs('EPSG:4326')
+
+        cities = cities[cities.geometry.notna() & ~cities.geometry.is_empty]
+        self._city_index = _PolygonIndex(cities.geometry.values)
+        self._city_names = cities[name_column].to_numpy(dtype=object)
+        self._city_areas = shapely.area(self._city_index.geometries)
+
+        print(f"Загружено {len(cities)} границ городов из {boundaries_file}")
+
+    def cities_for_points(self, lats, lons) -> np.ndarray:
+        """
+        Определяет города для массива точек по загруженным границам.
+
+        Если точка попадает в несколько вложенных границ, выбирается
+        наименьшая по площади (самая конкретная).
+
+        Returns:
+            Массив названий городов (None для точек вне всех границ)
+        """
+        if self._city_index is None:
+            raise ValueError("Границы городов не загружены (см. load_city_boundaries)")
+
+        lats = np.atleast_1d(np.asarray(lats, dtype=float))
+        lons = np.atleast_1d(np.asarray(lons, dtype=float))
+
+        point_idx, city_pos = self._city_index.query_points(lats, lons)
+        order = np.lexsort((self._city_areas[city_pos], point_idx))
+        point_idx, city_pos = point_idx[order], city_pos[order]
+        first = np.unique(point_idx, return_index=True)[1]
+
+        cities = np.full(len(lats), None, dtype=object)
+        cities[point_idx[first]] = self._city_names[city_pos[first]]
+        return cities
+
+    def _reverse_geocode(self, lat: float, lon: float, session=None) -> Optional[str]:
+        """
+        Выполняет один запрос обратного геокодирования к self.geocoder_url.
+
+        Ответы, отличные от 200, и сетевые ошибки выбрасываются как
+        requests.RequestException, чтобы вызывающий код мог повторить запрос.
+        Успешный результат сохраняется в self.geocode_cache.
+        """
+        params = {
+            'format': 'json',
+            'lat': lat,
+            'lon': lon,
+            'zoom': 10,
+            'addressdetails': 1
+        }
+        headers = {'User-Agent': 'RTEZoneChecker/1.0'}
+        response = (session or requests).get(self.geocoder_url, params=params, headers=headers, timeout=10)
+
+        if response.status_code != 200:
+            raise requests.HTTPError(f"Ошибка API: {response.status_code}", response=response)
+
+        address = response.json().get('address', {})
+        city = (
+            address.get('city')
+            or address.get('town')
+            or address.get('village')
+            or address.get('municipality')
+            or address.get('county')
+        )
+
+        if self.geocode_cache is not None:
+            self.geocode_cache.set(lat, lon, city)
+        return city
+
     def get_city_from_coordinates(self, lat: float, lon: float, delay: float = 1.0) -> Optional[str]:
         """
         Получает название города по координатам через Nominatim API.
+
+        Если загружены локальные границы городов (load_city_boundaries),
+        город определяется офлайн без HTTP-запроса.
         """
-        try:
-            url = "https://nominatim.openstreetmap.org/reverse"
-            params = {
-                'format': 'json',
-                'lat': lat,
-                'lon': lon,
-                'zoom': 10,
-                'addressdetails': 1
-            }
-            headers = {'User-Agent': 'RTEZoneChecker/1.0'}
-            response = requests.get(url, params=params, headers=headers, timeout=10)
-
-            if response.status_code == 200:
-                data = response.json()
-                address = data.get('address', {})
-                city = (
-                    address.get('city')
-                    or address.get('town')
-                    or address.get('village')
-                    or address.get('municipality')
-                    or address.get('county')
-                )
+        if self._city_index is not None:
+            return self.cities_for_points(lat, lon)[0]
+
+        if not (math.isfinite(lat) and math.isfinite(lon)):
+            return None
 
-                if delay > 0:
-                    time.sleep(delay)
+        if self.geocode_cache is not None:
+            found, city = self.geocode_cache.get(lat, lon)
+            if found:
                 return city
 
-            else:
-                print(f"Ошибка API: {response.status_code}")
-                return None
+        try:
+            city = self._reverse_geocode(lat, lon)
+            if delay > 0:
+                time.sleep(delay)
+            return city
 
         except Exception as e:
             print(f"Ошибка при получении города для координат ({lat}, {lon}): {e}")
             return None
 
+    def _geocode_with_retries(self, lat: float, lon: float, limiter: TokenBucket,
+                              max_retries: int, backoff: float, session=None) -> Optional[str]:
+        """Геокодирует точку с учетом общего лимита частоты и повторами с экспоненциальной паузой."""
+        if not (math.isfinite(lat) and math.isfinite(lon)):
+            # Центроид пустой геометрии: запрашивать геокодер бессмысленно
+            return None
+
+        if self.geocode_cache is not None:
+            found, city = self.geocode_cache.get(lat, lon)
+            if found:
+                return city
+
+        for attempt in range(max_retries + 1):
+            limiter.acquire()
+            try:
+                return self._reverse_geocode(lat, lon, session=session)
+            except Exception as e:
+                retryable = not isinstance(e, requests.HTTPError) or (
+                    e.response is not None and (e.response.status_code == 429 or e.response.status_code >= 500)
+                )
+                if attempt == max_retries or not retryable:
+                    print(f"Ошибка при получении города для координат ({lat}, {lon}): {e}")
+                    return None
+                time.sleep(backoff * 2 ** attempt)
+
     def get_city_from_geometry(self, geometry) -> Optional[str]:
         """Получает город для геометрии (использует центроид)."""
         try:
@@ -180,25 +1678,77 @@ class RTEZoneChecker:
             print(f"Ошибка при получении города для геометрии: {e}")
             return None
 
-    def add_city_column(self, save_file: Optional[str] = None, batch_size: int = 10):
+    def add_city_column(self, save_file: Optional[str] = None, batch_size: int = 10,
+                        workers: int = 4, rate_limit: float = 1.0,
+                        max_retries: int = 3, backoff: float = 1.0):
         """
         Добавляет колонку с городом для каждой геозоны.
+
+        Запросы к геокодеру выполняются пулом потоков с общим ограничением
+        частоты, а результаты записываются в self.gdf в порядке геозон.
+        Если загружены локальные границы городов, все города определяются
+        одним векторизованным запросом без обращения к сети.
+
+        Args:
+            save_file: файл для промежуточных и итогового сохранения
+            batch_size: промежуточное сохранение каждые batch_size геозон
+            workers: число одновременных запросов
+            rate_limit: максимум запросов в секунду для всего пула
+                (публичный Nominatim допускает не более 1)
+            max_retries: число повторов при сетевых ошибках, 429 и 5xx
+            backoff: начальная пауза перед повтором, удваивается с каждой попыткой
         """
-        if self.gdf is None:
-            raise ValueError("Данные не загружены")
+        data = self._require_data()
+        gdf = data.gdf
 
         print("Начинаю добавление информации о городах...")
 
-        if 'city' not in self.gdf.columns:
-            self.gdf['city'] = None
+        if 'city' not in gdf.columns:
+            gdf['city'] = None
+
+        pending = gdf['city'].isna() | (gdf['city'] == '')
+        positions = np.flatnonzero(pending.to_numpy())
+        centroids = shapely.centroid(data.index.geometries[positions])
+        # У пустых геометрий центроида нет: их координаты NaN, город для них не ищется
+        lats, lons = np.full(len(positions), np.nan), np.full(len(positions), np.nan)
+        present = ~shapely.is_empty(centroids)
+        lats[present], lons[present] = shapely.get_y(centroids[present]), shapely.get_x(centroids[present])
+
+        if self._city_index is not None:
+            gdf.loc[gdf.index[positions], 'city'] = self.cities_for_points(lats, lons)
+            print(f"Города определены по локальным границам для {len(positions)} геозон")
+        else:
+            self._geocode_zones(data, positions, lats, lons, save_file, batch_size,
+                                workers, rate_limit, max_retries, backoff)
 
-        total_zones = len(self.gdf)
+        data.columns.pop('city', None)
+        # Закэшированные результаты проверок получены без колонки 'city'
+        if self.result_cache is not None:
+            self.result_cache.clear()
+        print("Завершено добавление информации о городах")
+
+        if save_file:
+            self.save_data(save_file)
+
+    def _geocode_zones(self, data: _ZoneData, positions: np.ndarray, lats: np.ndarray, lons: np.ndarray,
+                       save_file: Optional[str], batch_size: int, workers: int,
+                       rate_limit: float, max_retries: int, backoff: float):
+        """Геокодирует центроиды геозон пулом потоков и записывает города в gdf по порядку."""
+        gdf = data.gdf
+        total_zones = len(gdf)
+        limiter = TokenBucket(rate_limit, capacity=min(workers, rate_limit))
         processed = 0
 
-        for idx, row in self.gdf.iterrows():
-            if pd.isna(row['city']) or row['city'] == '':
-                city = self.get_city_from_geometry(row.geometry)
-                self.gdf.at[idx, 'city'] = city
+        with requests.Session() as session, ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(workers, 1))
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            cities = executor.map(
+                lambda i: self._geocode_with_retries(lats[i], lons[i], limiter, max_retries, backoff, session),
+                range(len(positions)),
+            )
+            for pos, city in zip(positions, cities):
+                gdf.at[gdf.index[pos], 'city'] = city
                 processed += 1
 
                 print(f"Обработано {processed}/{total_zones}: {city}")
@@ -207,49 +1757,98 @@ class RTEZoneChecker:
                     self.save_data(save_file)
                     print("Промежуточное сохранение выполнено")
 
-        print("Завершено добавление информации о городах")
+    def save_data(self, filename: str, chunk_size: Optional[int] = None):
+        """
+        Сохраняет данные в файл.
 
-        if save_file:
-            self.save_data(save_file)
+        К исходным колонкам добавляются новые колонки из self.gdf (например,
+        'city') соединением по индексу.
 
-    def save_data(self, filename: str):
-        """Сохраняет данные в файл."""
-        if self.gdf is None:
+        Args:
+            filename: путь к файлу (.xlsx или .csv)
+            chunk_size: если задан, данные собираются и записываются частями
+                по chunk_size строк без полной копии self.df
+        """
+        data = self._data
+        if data is None:
             raise ValueError("Нет данных для сохранения")
+        data.load_columns()
+        if not filename.endswith(('.xlsx', '.csv')):
+            raise ValueError("Поддерживаются только форматы .xlsx и .csv")
+
+        df, gdf = data.df, data.gdf
+        new_columns = [col for col in gdf.columns if col not in df.columns and col != 'geometry']
+        extra = gdf[new_columns]
+
+        # В компактном режиме WKT разобранных геозон восстанавливается из геометрий
+        restored_wkt = None
+        if data.compact and 'WKT' in df.columns:
+            restored_wkt = pd.Series(shapely.to_wkt(gdf.geometry.values, rounding_precision=-1), index=gdf.index)
 
-        save_df = self.df.copy()
-        for col in self.gdf.columns:
-            if col not in save_df.columns and col != 'geometry':
-                for idx in save_df.index:
-                    if idx in self.gdf.index:
-                        save_df.at[idx, col] = self.gdf.at[idx, col]
+        if chunk_size is None:
+            chunk_size = max(len(df), 1)
+
+        chunks = (
+            df.iloc[start:start + chunk_size].join(extra)
+            for start in range(0, max(len(df), 1), chunk_size)
+        )
+        if restored_wkt is not None:
+            chunks = (chunk.assign(WKT=chunk['WKT'].fillna(restored_wkt)) for chunk in chunks)
 
         if filename.endswith('.xlsx'):
-            save_df.to_excel(filename, index=False)
-        elif filename.endswith('.csv'):
-            save_df.to_csv(filename, index=False)
+            with pd.ExcelWriter(filename) as writer:
+                written = 0
+                for chunk in chunks:
+                    first = written == 0
+                    chunk.to_excel(writer, index=False, header=first, startrow=0 if first else written + 1)
+                    written += len(chunk)
         else:
-            raise ValueError("Поддерживаются только форматы .xlsx и .csv")
+            for i, chunk in enumerate(chunks):
+                chunk.to_csv(filename, index=False, mode='w' if i == 0 else 'a', header=i == 0)
 
         print(f"Данные сохранены в {filename}")
 
+    def memory_usage(self) -> dict:
+        """
+        Оценка памяти, занятой данными геозон, в байтах.
+
+        'geometries' - объем координат в GEOS (16 байт на вершину), без
+        подготовленных структур и пространственного индекса.
+        """
+        data = self._require_data()
+        usage = {
+            'compact': data.compact,
+            'df': int(data.df.memory_usage(deep=True).sum()),
+            'gdf_attributes': int(data.gdf.drop(columns=data.gdf.geometry.name).memory_usage(deep=True).sum()),
+            'geometries': int(shapely.get_num_coordinates(data.index.geometries).sum()) * 16,
+            'column_cache': int(sum(values.nbytes for values in data.columns.values())),
+            'lazy_columns': list(data.lazy_columns),
+        }
+        usage['total'] = usage['df'] + usage['gdf_attributes'] + usage['geometries'] + usage['column_cache']
+        return usage
+
     def get_stats(self) -> dict:
-        """Получает статистику по геозонам."""
-        if self.gdf is None:
+        """Получает статистику по геозонам (загружает только нужные колонки)."""
+        data = self._data
+        if data is None:
             return {}
 
+        def column(name: str) -> Optional[pd.Series]:
+            return pd.Series(data.column_values(name)) if data.has_column(name) else None
+
+        partners, restaurants, cities = column('Партнер'), column('ID реста'), column('city')
         stats = {
-            'total_zones': len(self.gdf),
-            'partners': self.gdf['Партнер'].nunique() if 'Партнер' in self.gdf.columns else 0,
-            'restaurants': self.gdf['ID реста'].nunique() if 'ID реста' in self.gdf.columns else 0,
+            'total_zones': len(data.gdf),
+            'partners': partners.nunique() if partners is not None else 0,
+            'restaurants': restaurants.nunique() if restaurants is not None else 0,
         }
 
-        if 'Партнер' in self.gdf.columns:
-            stats['partner_distribution'] = self.gdf['Партнер'].value_counts().to_dict()
+        if partners is not None:
+            stats['partner_distribution'] = partners.value_counts().to_dict()
 
-        if 'city' in self.gdf.columns:
-            stats['cities'] = self.gdf['city'].nunique()
-            stats['city_distribution'] = self.gdf['city'].value_counts().head(10).to_dict()
+        if cities is not None:
+            stats['cities'] = cities.nunique()
+            stats['city_distribution'] = cities.value_counts().head(10).to_dict()
 
         return stats
 
@@ -274,19 +1873,375 @@ class RTEZoneChecker:
                 print(f"  {city}: {count}")
 
 
+_checker_cache = {}
+_checker_cache_lock = threading.Lock()
+
+
+def _file_stamp(path: str) -> Tuple[int, int]:
+    """Возвращает отпечаток файла (mtime в наносекундах, размер) для проверки изменений."""
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def get_checker(polygons_file: str = 'polygons.xlsx') -> RTEZoneChecker:
+    """
+    Возвращает загруженный RTEZoneChecker из кэша процесса.
+
+    Кэш привязан к абсолютному пути файла и потокобезопасен. Если у файла
+    изменились mtime или размер, данные загружаются заново.
+    """
+    path = os.path.abspath(polygons_file)
+    stamp = _file_stamp(path)
+
+    with _checker_cache_lock:
+        cached = _checker_cache.get(path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+
+        checker = RTEZoneChecker(polygons_file)
+        _checker_cache[path] = (stamp, checker)
+        return checker
+
+
+def clear_checker_cache():
+    """Очищает кэш загруженных RTEZoneChecker."""
+    with _checker_cache_lock:
+        _checker_cache.clear()
+
+
 def check_point_simple(lat: float, lon: float, polygons_file: str = 'polygons.xlsx') -> bool:
     """Простая функция для быстрой проверки точки."""
-    checker = RTEZoneChecker(polygons_file)
+    checker = get_checker(polygons_file)
     return checker.is_point_in_any_zone(lat, lon)
 
 
 def get_delivery_restaurants(lat: float, lon: float, polygons_file: str = 'polygons.xlsx') -> List[dict]:
     """Получает список ресторанов для доставки в точку."""
-    checker = RTEZoneChecker(polygons_file)
+    checker = get_checker(polygons_file)
     return checker.get_restaurants_for_point(lat, lon)
 
 
-def main():
+_HTTP_REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error',
+}
+
+
+class ZoneLookupServer:
+    """
+    HTTP-сервис проверки геозон на asyncio.
+
+    Все запросы обслуживаются одним загруженным RTEZoneChecker.
+    Соединения HTTP/1.1 поддерживают keep-alive; соединение, на котором
+    idle_timeout секунд не приходит данных, закрывается. По SIGTERM
+    сервер перестает принимать соединения и дорабатывает начатые запросы
+    (shutdown).
+
+    Эндпоинты:
+        GET  /contains?lat=..&lon=..     -> {"in_zone": true}
+        GET  /zones?lat=..&lon=..        -> {"zones": [...]} (без геометрий)
+        GET  /restaurants?lat=..&lon=..  -> {"restaurants": [...]}
+        GET  /health                     -> {"status": "ok", "zones": N}
+        POST /batch {"lats": [...], "lons": [...]} или {"points": [[lat, lon], ...]}
+             -> {"point_idx": [...], "zone_idx": [...]}
+    """
+
+    def __init__(self, checker: RTEZoneChecker, max_body: int = 16 * 1024 * 1024,
+                 idle_timeout: float = 30.0):
+        self.checker = checker
+        self.max_body = max_body
+        self.idle_timeout = idle_timeout
+        self._draining = False
+        self._connections = set()
+        self._idle = set()
+        self._routes = {
+            '/contains': lambda lat, lon: {'in_zone': self.checker.is_point_in_any_zone(lat, lon)},
+            '/zones': lambda lat, lon: {
+                'zones': self.checker.point_in_zones(lat, lon, include_geometry=False)
+            },
+            '/restaurants': lambda lat, lon: {
+                'restaurants': self.checker.get_restaurants_for_point(lat, lon)
+            },
+        }
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8080, sock: Optional[socket.socket] = None):
+        """
+        Запускает сервер в текущем цикле событий и возвращает asyncio.Server.
+
+        Если передан sock, используется готовый слушающий сокет
+        (например, унаследованный от родителя в многопроцессном режиме).
+        """
+        if sock is not None:
+            return await asyncio.start_server(self._handle_connection, sock=sock)
+        return await asyncio.start_server(self._handle_connection, host, port)
+
+    def serve_forever(self, host: str = '127.0.0.1', port: int = 8080, sock: Optional[socket.socket] = None):
+        """Запускает сервер и обслуживает запросы до прерывания или SIGTERM."""
+        async def run():
+            server = await self.start(host, port, sock=sock)
+            stopped = asyncio.Event()
+            try:
+                asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stopped.set)
+            except (NotImplementedError, RuntimeError, ValueError):
+                pass  # не главный поток: останавливается только прерыванием
+            print(f"Сервис геозон слушает http://{host}:{port} (pid {os.getpid()})")
+            await stopped.wait()
+            await self.shutdown(server)
+
+        try:
+            asyncio.run(run())
+        except KeyboardInterrupt:
+            pass
+        print("Сервис остановлен")
+
+    async def shutdown(self, server: asyncio.AbstractServer):
+        """
+        Останавливает прием соединений и дожидается начатых запросов.
+
+        Простаивающие соединения keep-alive закрываются сразу, остальные -
+        после текущего ответа; ожидание ограничено idle_timeout.
+        """
+        server.close()
+        self._draining = True
+        for task in list(self._idle):
+            task.cancel()
+        if self._connections:
+            await asyncio.wait(list(self._connections), timeout=self.idle_timeout)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Обрабатывает запросы одного соединения до его закрытия."""
+        timeout = self.idle_timeout
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while not self._draining:
+                # Между запросами соединение простаивает и при shutdown закрывается сразу
+                self._idle.add(task)
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), timeout)
+                finally:
+                    self._idle.discard(task)
+                if not request_line:
+                    break
+
+                parts = request_line.decode('latin-1').split()
+                if len(parts) != 3:
+                    writer.write(self._response(400, {'error': 'Некорректная строка запроса'}, False))
+                    break
+                method, target, version = parts
+
+                headers = {}
+                while True:
+                    line = await asyncio.wait_for(reader.readline(), timeout)
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection == 'keep-alive' if version == 'HTTP/1.0' else connection != 'close'
+
+                length = headers.get('content-length') or '0'
+                if not (length.isascii() and length.isdigit()):
+                    writer.write(self._response(400, {'error': 'Некорректный Content-Length'}, False))
+                    break
+                length = int(length)
+                if length > self.max_body:
+                    writer.write(self._response(413, {'error': 'Слишком большое тело запроса'}, False))
+                    break
+                body = await asyncio.wait_for(reader.readexactly(length), timeout) if length else b''
+
+                status, payload = self._dispatch(method, target, body)
+                keep_alive = keep_alive and not self._draining
+                writer.write(self._response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError,
+                asyncio.CancelledError):
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    def _dispatch(self, method: str, target: str, body: bytes) -> Tuple[int, dict]:
+        """Выполняет запрос и возвращает (HTTP-статус, тело ответа)."""
+        url = urlsplit(target)
+        try:
+            if url.path == '/batch':
+                if method != 'POST':
+                    return 405, {'error': 'Используйте POST'}
+                return 200, self._batch(json.loads(body or b'{}'))
+
+            if url.path == '/health':
+                health = {'status': 'ok', 'zones': len(self.checker._require_data().gdf)}
+                if self.checker.result_cache is not None:
+                    health['result_cache'] = self.checker.result_cache.stats()
+                return 200, health
+
+            handler = self._routes.get(url.path)
+            if handler is None:
+                return 404, {'error': f"Неизвестный путь {url.path}"}
+            if method != 'GET':
+                return 405, {'error': 'Используйте GET'}
+
+            params = parse_qs(url.query)
+            return 200, handler(float(params['lat'][0]), float(params['lon'][0]))
+
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            return 400, {'error': f"Некорректный запрос: {e}"}
+        except Exception as e:
+            print(f"Ошибка при обработке запроса {method} {target}: {e}")
+            return 500, {'error': 'Внутренняя ошибка сервиса'}
+
+    def _batch(self, request: dict) -> dict:
+        """Пакетная проверка точек через point_in_zones_many."""
+        if 'points' in request:
+            points = np.asarray(request['points'], dtype=float).reshape(-1, 2)
+            lats, lons = points[:, 0], points[:, 1]
+        else:
+            lats, lons = request['lats'], request['lons']
+
+        point_idx, zone_idx = self.checker.point_in_zones_many(lats, lons)
+        return {'point_idx': point_idx.tolist(), 'zone_idx': zone_idx.tolist()}
+
+    @staticmethod
+    def _response(status: int, payload: dict, keep_alive: bool) -> bytes:
+        """Формирует HTTP-ответ с JSON-телом."""
+        try:
+            body = json.dumps(payload, ensure_ascii=False, default=_json_default, allow_nan=False)
+        except ValueError:
+            # NaN не входит в JSON; обход ответа нужен только в этом редком случае
+            body = json.dumps(_finite_json(payload), ensure_ascii=False, default=_json_default)
+        body = body.encode('utf-8')
+        head = (
+            f"HTTP/1.1 {status} {_HTTP_REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        return head.encode('latin-1') + body
+
+
+def serve_prefork(checker: RTEZoneChecker, host: str = '127.0.0.1', port: int = 8080, workers: int = 2,
+                  reload_interval: Optional[float] = None):
+    """
+    Многопроцессный режим HTTP-сервиса (pre-fork).
+
+    Родительский процесс один раз загружает и индексирует геозоны, открывает
+    слушающий сокет и порождает workers процессов через fork. Дочерние
+    процессы наследуют готовый индекс: геометрии GEOS, STRtree и массивы
+    колонок разделяются с родителем через copy-on-write и не копируются,
+    а polygons.xlsx не перечитывается. gc.freeze() перед fork не дает
+    сборщику мусора трогать унаследованные объекты и копировать их страницы.
+
+    Упавший процесс перезапускается; SIGINT/SIGTERM завершают всех.
+    Если задан reload_interval, изменения файла полигонов отслеживает
+    родитель: он один раз перечитывает данные и поочередно заменяет
+    процессы новыми (rolling restart), так что данные по-прежнему
+    хранятся в одном экземпляре. Заменяемые процессы получают SIGTERM,
+    перестают принимать соединения и дорабатывают начатые запросы на
+    старых данных (ZoneLookupServer.shutdown).
+    """
+    if not hasattr(os, 'fork'):
+        raise RuntimeError("Многопроцессный режим требует os.fork (Linux/macOS)")
+
+    server = ZoneLookupServer(checker)
+
+    def prepare_fork():
+        # Заполняем кэши колонок до fork, чтобы процессы разделяли их, а не строили заново.
+        # Отложенные колонки не трогаем: их загрузка свела бы на нет key_columns
+        data = server.checker._require_data()
+        for column in data.gdf.columns:
+            if column != data.gdf.geometry.name:
+                data.column_values(column)
+        # После перезагрузки старые данные должны собираться, поэтому сначала unfreeze
+        gc.unfreeze()
+        gc.collect()
+        gc.freeze()
+
+    sock = socket.create_server((host, port), backlog=1024)
+    prepare_fork()
+
+    children = set()
+    retiring = set()
+    stopping = False
+
+    def spawn():
+        sys.stdout.flush()
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            try:
+                server.serve_forever(host, port, sock=sock)
+            finally:
+                sys.stdout.flush()
+                os._exit(0)
+        children.add(pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children | retiring):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for _ in range(workers):
+        spawn()
+    print(f"Запущено {workers} процессов сервиса геозон на http://{host}:{port}")
+
+    next_check = time.monotonic() + reload_interval if reload_interval else None
+    while children or retiring:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG if next_check is not None else 0)
+        except ChildProcessError:
+            break
+
+        if pid == 0:
+            time.sleep(0.2)
+            if not stopping and time.monotonic() >= next_check:
+                next_check = time.monotonic() + reload_interval
+                try:
+                    reloaded = checker.reload_if_changed()
+                except Exception as e:
+                    print(f"Ошибка перезагрузки геозон, процессы работают на старых данных: {e}")
+                    reloaded = False
+                if reloaded:
+                    prepare_fork()
+                    print("Геозоны перезагружены, поочередно заменяю процессы")
+                    for old_pid in list(children):
+                        spawn()
+                        children.discard(old_pid)
+                        retiring.add(old_pid)
+                        try:
+                            os.kill(old_pid, signal.SIGTERM)
+                        except ProcessLookupError:
+                            pass
+            continue
+
+        if pid in retiring:
+            retiring.discard(pid)
+            continue
+        children.discard(pid)
+        if not stopping:
+            print(f"Процесс {pid} завершился, запускаю замену")
+            spawn()
+
+    sock.close()
+    print("Сервис остановлен")
+
+
+def demo():
     """Демонстрация работы с RTE Zones."""
     print("🗺️  RTE Zones - Проверка геозон доставки")
     print("=" * 50)
@@ -331,5 +2286,54 @@ def main():
         print(f"❌ Произошла ошибка: {e}")
 
 
+def main(argv: Optional[List[str]] = None):
+    """
+    Точка входа командной строки.
+
+    python rte_zones.py               - демонстрация
+    python -m rte_zones serve [опции] - HTTP-сервис проверки геозон
+    """
+    parser = argparse.ArgumentParser(description="RTE Zones - проверка геозон доставки")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('demo', help="демонстрация работы (по умолчанию)")
+
+    serve_parser = subparsers.add_parser('serve', help="HTTP-сервис проверки геозон")
+    serve_parser.add_argument('--polygons', default='polygons.xlsx', help="файл с полигонами")
+    serve_parser.add_argument('--snapshot', default=None, help="бинарный снимок для быстрого старта")
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8080)
+    serve_parser.add_argument('--workers', type=int, default=1,
+                              help="число процессов; больше 1 - режим pre-fork с общим индексом")
+    serve_parser.add_argument('--reload-interval', type=float, default=None,
+                              help="период проверки изменений файла полигонов, секунд")
+    serve_parser.add_argument('--coverage-cell', type=float, default=None,
+                              help="размер ячейки сетки покрытия для /contains, градусов")
+    serve_parser.add_argument('--compact', action='store_true',
+                              help="компактный режим хранения (без WKT, строки как category)")
+    serve_parser.add_argument('--key-columns', nargs='+', default=None,
+                              help="колонки, загружаемые сразу (например, LOOKUP_COLUMNS); "
+                                   "остальные читаются при первом обращении")
+    serve_parser.add_argument('--result-cache', type=int, default=None,
+                              help="размер LRU-кэша результатов /zones и /restaurants")
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        result_cache = ResultCache(args.result_cache) if args.result_cache else None
+        checker = RTEZoneChecker(args.polygons, snapshot_file=args.snapshot,
+                                 result_cache=result_cache, compact=args.compact,
+                                 key_columns=args.key_columns)
+        if args.coverage_cell:
+            checker.enable_coverage_grid(args.coverage_cell)
+        if args.workers > 1:
+            serve_prefork(checker, args.host, args.port, args.workers, args.reload_interval)
+        else:
+            if args.reload_interval:
+                checker.start_auto_reload(args.reload_interval)
+            ZoneLookupServer(checker).serve_forever(args.host, args.port)
+    else:
+        demo()
+
+
 if __name__ == "__main__":
     main()